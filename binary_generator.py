@@ -1,10 +1,14 @@
 import os
+import platform
+import json
+from collections import defaultdict
 import subprocess
 import concurrent.futures
 import hashlib
 import shutil
 import time
 import multiprocessing
+import multiprocessing.pool
 import tempfile
 from typing import List, Dict, Any, Tuple, Optional
 import itertools
@@ -12,31 +16,82 @@ from pathlib import Path
 import logging
 from dataclasses import dataclass, field
 
-from utils import LineNumberExtractor, get_compiler_version, find_c_files, find_c_files_int
+from utils import (LineNumberExtractor, get_compiler_version, find_c_files, find_c_files_int,
+                   load_lldb_interface, fast_copy, resolve_tool)
 from get_debug_values import get_debug_values
 
+# Opened once per process and handed to every compiler run instead of
+# subprocess.DEVNULL, which opens /dev/null afresh on each call. Our own fds are
+# non-inheritable, so close_fds=False is safe and skips the close-all-fds loop.
+_DEVNULL_FD = os.open(os.devnull, os.O_RDWR)
+
+IS_MACOS = platform.system() == "Darwin"
+
+HASH_CHUNK_SIZE = 1 << 18  # 256 KiB
+HASH_DIGEST_SIZE = 16  # bytes, for the variable-length BLAKE2 family
+
+
+def new_hash(algorithm: str):
+    # The hash only deduplicates binaries within a run, so a 128-bit BLAKE2 digest
+    # is plenty; other algorithms (e.g. sha256) keep their native digest size.
+    if algorithm.startswith("blake2"):
+        return hashlib.new(algorithm, digest_size=HASH_DIGEST_SIZE)
+    return hashlib.new(algorithm)
+
+
+# LLDB keeps process-wide state and is not safe to drive from several threads, so
+# everything that runs it goes through worker processes. The pool is created once per
+# process and multiprocessing's exit handlers terminate it. lldb is imported by the
+# first task in each worker (load_lldb_interface is memoized) rather than by a pool
+# initializer: a failing initializer makes the pool respawn workers forever instead
+# of raising from map().
+_lldb_pool: Optional[multiprocessing.pool.Pool] = None
+
+
+def get_lldb_pool() -> multiprocessing.pool.Pool:
+    global _lldb_pool
+    if _lldb_pool is None:
+        _lldb_pool = multiprocessing.Pool()
+    return _lldb_pool
+
 
 @dataclass
 class CompilerConfig:
     compiler_path: str
     opt_levels: List[str] = field(default_factory=lambda: ['0', '1', '2', '3', 's', 'z'])
     dbg_levels: List[str] = field(default_factory=lambda: ['1', '2', '3'])
+    hash_algorithm: str = "blake2b"  # any hashlib name, e.g. "sha256"
+    # Skip an -O level whose -g0 assembly matches an earlier level's. Off by default:
+    # equal code does not imply equal -g1/2/3 debug info, so variants can be lost
+    dedup_by_codegen: bool = False
   
 
-# @dataclass
-# class BinaryConfig:
-#     hash_algorithm: str = "sha256"
-
 @dataclass
 class AnalysisConfig:
     evidence_dir: Path
     analysis_timeout: int = 300  # seconds
+    # Reuse compiled variants across runs, see BinaryCache. Opt-in: entries are never
+    # evicted, and sources that are analysed only once never hit
+    use_cache: bool = False
+    # Keep only the is_stmt lines actually hit when the binary runs under lldb (one
+    # launch per binary). Without it, every never-executed line costs its own
+    # get_debug_values launch in find_issues_type1_2.
+    verify_line_numbers: bool = True
 
 @dataclass
 class ParallelConfig:
     max_workers: int = field(default_factory=lambda: multiprocessing.cpu_count())
 
 
+def extract_line_numbers(file_path: str, verify: bool = False) -> Dict[str, List[int]]:
+    # Takes and returns plain data only, so it can be handed to any executor
+    try:
+        return LineNumberExtractor(verify=verify).get_line_nums(file_path)
+    except Exception as e:
+        logging.error(f"Error extracting line numbers for {os.path.basename(file_path)}: {str(e)}")
+        return {}
+
+
 class Binary:
     def __init__(self, 
                  compiler_config: CompilerConfig, 
@@ -52,18 +107,20 @@ class Binary:
         self.file_path = Path(output_dir) / self.file_name
         self.hash_value = None
         self.line_numbers = {}  # Dict[str, List[int]] to handle multiple source files
-        self.hash_algorithm: str = "sha256"
+        self.hash_algorithm: str = compiler_config.hash_algorithm
+        self.cache_key: Optional[str] = None
+        self.line_numbers_cached = False
   
     def generate_binary(self) ->bool:
         cmd = [
-            self.compiler_path,
+            resolve_tool(self.compiler_path),
             str(self.source_path),
             "-I/usr/local/include",
             f"-O{self.optimization_level}",
             f"-g{self.debug_level}",
             "-o", str(self.file_path)]
         try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            subprocess.run(cmd, check=True, stdout=_DEVNULL_FD, stderr=_DEVNULL_FD, close_fds=False)
             self.compute_hash()
             return True
         except subprocess.CalledProcessError as e:
@@ -72,18 +129,20 @@ class Binary:
             return False    
 
     def compute_hash(self) -> None:
-        with open(self.file_path, 'rb') as f:
-            # self.hash_value = hashlib.md5(f.read()).hexdigest()
-            self.hash_value = hashlib.new(self.hash_algorithm, f.read()).hexdigest()
+        # Hash in fixed-size chunks so a large ELF never has to sit in memory whole.
+        # A single reused buffer avoids allocating a fresh bytes object per chunk
+        # while the just-linked file is still hot in the page cache.
+        h = new_hash(self.hash_algorithm)
+        buf = bytearray(HASH_CHUNK_SIZE)
+        view = memoryview(buf)
+        with open(self.file_path, 'rb', buffering=0) as f:
+            while n := f.readinto(buf):
+                h.update(view[:n])
+        self.hash_value = h.hexdigest()
  
-    def get_line_numbers(self) -> None:
-        try:
-            extractor = LineNumberExtractor()
-            self.line_numbers = extractor.get_line_nums(str(self.file_path))
-            # logging.info(f"Line numbers for {self.file_name}: {self.line_numbers}")
-        except Exception as e:
-            logging.error(f"Error extracting line numbers for {self.file_name}: {str(e)}")
-            self.line_numbers = {}
+    def get_line_numbers(self, verify: bool = False) -> None:
+        self.line_numbers = extract_line_numbers(str(self.file_path), verify)
+        # logging.info(f"Line numbers for {self.file_name}: {self.line_numbers}")
 
     def cleanup(self):
         if self.file_path.exists():
@@ -91,6 +150,90 @@ class Binary:
         # Clear any other resources if necessary
         self.line_numbers.clear()
 
+class BinaryCache:
+    """
+    Persistent memo of compiled variants, stored under <evidence_dir>/.cache.
+
+    Each entry is keyed on (compiler path, compiler version, source path, working
+    directory, source hash, -O, -g) and holds a copy of the binary (and its .dSYM
+    bundle on macOS) plus a <key>.json with its hash and, once extracted, its line
+    numbers, so an unchanged source skips compile, hash and dwarfdump entirely on
+    the next run. The path and working directory are part of the key because the
+    binary records them (DW_AT_name, DW_AT_comp_dir) and the line numbers are
+    keyed by source file name.
+    """
+    def __init__(self, cache_dir: Path, verify_line_numbers: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.verify_line_numbers = verify_line_numbers
+
+    def key(self, binary: Binary, source_hash: str) -> str:
+        h = new_hash("blake2b")
+        parts = [binary.compiler_path, get_compiler_version(binary.compiler_path) or "",
+                 str(binary.source_path), str(binary.source_path.resolve()), os.getcwd(),
+                 source_hash, binary.optimization_level, binary.debug_level, binary.hash_algorithm]
+        for part in parts:
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def contains(self, binary: Binary) -> bool:
+        return ((self.cache_dir / f"{binary.cache_key}.json").exists()
+                and (self.cache_dir / f"{binary.cache_key}.out").exists()
+                and (not IS_MACOS or (self.cache_dir / f"{binary.cache_key}.dSYM").is_dir()))
+
+    def load(self, binary: Binary) -> bool:
+        try:
+            with (self.cache_dir / f"{binary.cache_key}.json").open() as f:
+                entry = json.load(f)
+            # On macOS the debug info lives in the .dSYM bundle, not in the binary
+            if IS_MACOS and not entry.get('dsym'):
+                return False
+            cached_binary = self.cache_dir / f"{binary.cache_key}.out"
+            fast_copy(cached_binary, binary.file_path)
+            shutil.copymode(cached_binary, binary.file_path)
+            if entry.get('dsym'):
+                dsym = Path(f"{binary.file_path}.dSYM")
+                shutil.rmtree(dsym, ignore_errors=True)
+                shutil.copytree(self.cache_dir / f"{binary.cache_key}.dSYM", dsym)
+        except (OSError, ValueError):
+            return False
+        binary.hash_value = entry['hash_value']
+        if 'line_numbers' in entry and entry.get('verified') == self.verify_line_numbers:
+            binary.line_numbers = entry['line_numbers']
+            binary.line_numbers_cached = True
+        return True
+
+    def store(self, binary: Binary, with_line_numbers: bool = False) -> None:
+        entry = {'hash_value': binary.hash_value}
+        if with_line_numbers:
+            entry['line_numbers'] = binary.line_numbers
+            entry['verified'] = self.verify_line_numbers
+        cached_binary = self.cache_dir / f"{binary.cache_key}.out"
+        cached_dsym = self.cache_dir / f"{binary.cache_key}.dSYM"
+        dsym = Path(f"{binary.file_path}.dSYM")
+        # Write to a private name first so concurrent analyses never see a partial entry
+        tmp_suffix = f".{os.getpid()}.tmp"
+        try:
+            if not cached_binary.exists():
+                fast_copy(binary.file_path, str(cached_binary) + tmp_suffix)
+                shutil.copymode(binary.file_path, str(cached_binary) + tmp_suffix)
+                os.replace(str(cached_binary) + tmp_suffix, cached_binary)
+            if dsym.is_dir() and not cached_dsym.exists():
+                shutil.copytree(dsym, str(cached_dsym) + tmp_suffix)
+                try:
+                    os.replace(str(cached_dsym) + tmp_suffix, cached_dsym)
+                except OSError:  # another analysis stored the bundle first
+                    shutil.rmtree(str(cached_dsym) + tmp_suffix, ignore_errors=True)
+            if cached_dsym.is_dir():
+                entry['dsym'] = True
+            entry_path = self.cache_dir / f"{binary.cache_key}.json"
+            with open(str(entry_path) + tmp_suffix, 'w') as f:
+                json.dump(entry, f)
+            os.replace(str(entry_path) + tmp_suffix, entry_path)
+        except OSError as e:
+            logging.warning(f"Failed to cache {binary.file_name}: {e}")
+
 class BinaryAnalyzer:
     def __init__(self, 
                  compiler_config: CompilerConfig, 
@@ -104,35 +247,105 @@ class BinaryAnalyzer:
         self.evidence_dir = analysis_config.evidence_dir    
         self.source_dir = self.source_path.parent #Path(os.path.dirname(source_file))
         self.binaries = []
+        self._binary_by_name: Dict[str, Binary] = {}
+        self.cache = (BinaryCache(self.evidence_dir / ".cache", analysis_config.verify_line_numbers)
+                      if analysis_config.use_cache else None)
+        self.source_hash = None
           
-    def _generate_binary(self, opt_level, debug_level) -> Optional[Binary]:
+    def _compute_source_hash(self) -> str:
+        h = new_hash("blake2b")
+        with open(self.source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _new_binary(self, opt_level, debug_level) -> Binary:
         binary = Binary(self.compiler_config, self.source_path, self.output_dir, opt_level, debug_level)
+        if self.cache:
+            binary.cache_key = self.cache.key(binary, self.source_hash)
+        return binary
+
+    def _variants_cached(self, opt_level) -> bool:
+        return self.cache is not None and all(
+            self.cache.contains(self._new_binary(opt_level, debug_level))
+            for debug_level in self.compiler_config.dbg_levels)
+
+    def _generate_binary(self, opt_level, debug_level) -> Optional[Binary]:
+        binary = self._new_binary(opt_level, debug_level)
+        if self.cache:
+            if self.cache.load(binary):
+                return binary
         if binary.generate_binary():
+            if self.cache:
+                self.cache.store(binary)
             return binary
         else:
             return None
     
+    def _codegen_signature(self, opt_level) -> Optional[str]:
+        cmd = [
+            resolve_tool(self.compiler_config.compiler_path),
+            str(self.source_path),
+            "-I/usr/local/include",
+            f"-O{opt_level}",
+            "-g0",
+            "-S", "-o", "-"]
+        try:
+            result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=_DEVNULL_FD, close_fds=False)
+        except subprocess.CalledProcessError:
+            return None
+        h = new_hash("blake2b")
+        h.update(result.stdout)
+        return h.hexdigest()
+
     def generate_variants(self):
+        if self.cache:
+            self.source_hash = self._compute_source_hash()
         file_hashes = set()
+        codegen_signatures = set()
         for opt_level in self.compiler_config.opt_levels:
+            # Cached variants cost no compile, so there is nothing to save by comparing code
+            if self.compiler_config.dedup_by_codegen and not self._variants_cached(opt_level):
+                signature = self._codegen_signature(opt_level)
+                if signature in codegen_signatures:
+                    logging.info(f"{self.source_path.name}: -O{opt_level} generates the same code as an earlier level, skipping")
+                    continue
+                if signature is not None:
+                    codegen_signatures.add(signature)
             for debug_level in self.compiler_config.dbg_levels:
                 binary = self._generate_binary(opt_level, debug_level)
                 if binary and binary.hash_value not in file_hashes:
                     # print(binary.hash_value)
                     self.binaries.append(binary)
                     file_hashes.add(binary.hash_value)
+        self._binary_by_name = {b.file_name: b for b in self.binaries}
          
-    @staticmethod
-    def _get_line_numbers(binary: Binary):
-        binary.get_line_numbers()
-        return binary
-    
     def get_line_numbers(self):
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            self.binaries = list(executor.map(self._get_line_numbers, self.binaries))
+        pending = [b for b in self.binaries if not b.line_numbers_cached]
+        if not pending:
+            return
+        file_paths = [str(b.file_path) for b in pending]
+        verify = self.analysis_config.verify_line_numbers
+        if verify:
+            # Verification runs each binary under LLDB, so it needs separate processes
+            results = get_lldb_pool().starmap(extract_line_numbers, zip(file_paths, itertools.repeat(verify)))
+        else:
+            # Without LLDB, extraction only waits on llvm-dwarfdump, so threads do the
+            # job without pickling Binary objects back and forth
+            max_workers = min(len(pending), os.cpu_count() or 1)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(extract_line_numbers, file_paths))
+        for binary, line_numbers in zip(pending, results):
+            binary.line_numbers = line_numbers
+        if self.cache:
+            # An empty result usually means extraction failed; don't make that sticky
+            for binary in pending:
+                if binary.line_numbers:
+                    self.cache.store(binary, with_line_numbers=True)
 
     @staticmethod
     def _find_issues_type1_2(binary):
+        load_lldb_interface()
         binary_issues = []
         for source_file, lines in binary.line_numbers.items():
             for line in lines:
@@ -161,8 +374,8 @@ class BinaryAnalyzer:
         return binary_issues
 
     def find_issues_type1_2(self):
-        with multiprocessing.Pool() as pool:
-            results = pool.map(self._find_issues_type1_2, self.binaries)
+        # get_debug_values drives LLDB in-process, so it runs on the shared LLDB pool
+        results = get_lldb_pool().map(self._find_issues_type1_2, self.binaries)
         issues = [issue for binary_issues in results for issue in binary_issues]
         if issues:
             self._write_results(issues)
@@ -171,22 +384,20 @@ class BinaryAnalyzer:
 
     def _write_results(self, issues: List[Dict[str, str]]):
         # Group issues by source file
-        issues_by_file = {}
+        issues_by_file = defaultdict(list)
         for issue in issues:
-            source_file = issue['source_file']
-            if source_file not in issues_by_file:
-                issues_by_file[source_file] = []
-            issues_by_file[source_file].append(issue)
+            issues_by_file[issue['source_file']].append(issue)
 
         # Write results for each source file
+        clang_version = get_compiler_version('clang')
         for source_file, file_issues in issues_by_file.items():
             source_file = Path(source_file)
             # Copy source file to evidence directory
-            shutil.copy2(self.source_dir / source_file, self.evidence_dir/source_file)
+            fast_copy(self.source_dir / source_file, self.evidence_dir/source_file)
             
             # Write results as comments at the end of the source file
             with (self.evidence_dir / source_file.name).open('a') as f:
-                f.write(f"\n\n//LLVM{get_compiler_version('clang')} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n")
+                f.write(f"\n\n//LLVM{clang_version} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n")
                 for issue in file_issues:
                     f.write(f"// {issue['binary']} {issue['line']}: {issue['error_message']}\n")
                 f.write("\n")
@@ -194,9 +405,10 @@ class BinaryAnalyzer:
         # Copy unique binaries with issues to evidence directory
         unique_binaries = set(issue['binary'] for issue in issues)
         for binary_name in unique_binaries:
-            binary = next((b for b in self.binaries if b.file_name == binary_name), None)
+            binary = self._binary_by_name.get(binary_name)
             if binary:
-                shutil.copy2(binary.file_path, self.evidence_dir / binary_name)
+                fast_copy(binary.file_path, self.evidence_dir / binary_name)
+                shutil.copymode(binary.file_path, self.evidence_dir / binary_name)  # keep it executable
             else:
                 print(f"Warning: Binary {binary_name} not found")
 
@@ -220,6 +432,7 @@ class BinaryAnalyzer:
         for binary in self.binaries:
             binary.cleanup()
         self.binaries.clear()
+        self._binary_by_name.clear()
         # Remove the output directory if it's empty
         if self.output_dir.exists() and not any(self.output_dir.iterdir()):
             self.output_dir.rmdir()
@@ -5,24 +5,90 @@ import re
 import tempfile
 import shutil
 import os
-from contextlib import contextmanager
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Optional
 from functools import lru_cache
+from multiprocessing.util import Finalize
+
+from utils import resolve_tool
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-@contextmanager
-def temp_directory():
-    temp_dir = tempfile.mkdtemp()
-    try:
-        yield Path(temp_dir)
-    finally:
-        shutil.rmtree(temp_dir)
+# Reused for all discarded output instead of subprocess.DEVNULL, which reopens /dev/null per call
+_DEVNULL_FD = os.open(os.devnull, os.O_RDWR)
+
+# One scratch directory per process rather than a mkdtemp/rmtree pair per check,
+# created on first use. Forked workers inherit an existing one and write uniquely
+# named files into it.
+_scratch: Optional[Path] = None
+_scratch_counter = itertools.count()
+
+def scratch_binary(stem: str) -> Path:
+    global _scratch
+    if _scratch is None:
+        _scratch = Path(tempfile.mkdtemp(prefix="checker-"))
+        # A multiprocessing finalizer, unlike atexit, also runs when a pool worker
+        # leaves through os._exit; a forked child never runs its parent's
+        Finalize(None, shutil.rmtree, args=(_scratch,), kwargs={'ignore_errors': True}, exitpriority=0)
+    return _scratch / f"{stem}_{os.getpid()}_{next(_scratch_counter)}.out"
+
+def discard_binary(binary: Path) -> None:
+    binary.unlink(missing_ok=True)
+    # clang emits a .dSYM bundle next to -g binaries on macOS
+    shutil.rmtree(f"{binary}.dSYM", ignore_errors=True)
+
+WARNINGS = (
+    "conversions than data arguments",
+    "incompatible redeclaration",
+    "ordered comparison between pointer",
+    "eliding middle term",
+    "end of non-void function",
+    "invalid in C99",
+    "specifies type",
+    "should return a value",
+    "uninitialized",
+    "incompatible pointer to",
+    "incompatible integer to",
+    "comparison of distinct pointer types",
+    "type specifier missing",
+    "Wimplicit-int",
+    "division by zero",
+    "without a cast",
+    "control reaches end",
+    "return type defaults",
+    "cast from pointer to integer",
+    "useless type name in empty declaration",
+    "no semicolon at end",
+    "type defaults to",
+    "too few arguments for format",
+    "incompatible pointer",
+    "ordered comparison of pointer with integer",
+    "declaration does not declare anything",
+    "expects type",
+    "pointer from integer",
+    "incompatible implicit",
+    "excess elements in struct initializer",
+    "comparison between pointer and integer",
+    "return type of 'main' is not 'int'",
+    "past the end of the array",
+    "no return statement in function returning non-void",
+    "undefined behavior",
+)
+# Matched with a single alternation instead of one substring scan per pattern.
+# Patterns that contain another pattern can never add a match, so they are dropped.
+WARNINGS_RE = re.compile("|".join(sorted(
+    re.escape(w) for w in set(WARNINGS)
+    if not any(other != w and other in w for other in WARNINGS)
+)))
+
+# Cached checks take the file's mtime (st_mtime_ns) as part of the key, so editing a
+# file invalidates its entries while results stay shared across Checker instances.
 
 @lru_cache(maxsize=128)
-def get_cc_output(cc: str, file: Path, flags: str, cc_timeout: int) -> Tuple[int, str]:
+def get_cc_output(cc: str, file: Path, file_mtime: int, flags: str, cc_timeout: int) -> Tuple[int, str]:
     cmd = [
-        cc,
+        resolve_tool(cc),
         str(file),
         "-c",
         "-o/dev/null",
@@ -35,84 +101,90 @@ def get_cc_output(cc: str, file: Path, flags: str, cc_timeout: int) -> Tuple[int
     ] + flags.split()
     
     try:
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=cc_timeout, text=True)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=False,
+                                timeout=cc_timeout, text=True)
         return result.returncode, result.stdout
     except subprocess.TimeoutExpired:
         return 1, ""
     except subprocess.CalledProcessError:
         return 1, ""
 
-def check_compiler_warnings(clang: str, gcc: str, file: Path, flags: str, cc_timeout: int) -> bool:
-    clang_rc, clang_output = get_cc_output(clang, file, flags, cc_timeout)
-    gcc_rc, gcc_output = get_cc_output(gcc, file, flags, cc_timeout)
+def warning_free(*cc_outputs: Tuple[int, str]) -> bool:
+    return all(rc == 0 and not WARNINGS_RE.search(output) for rc, output in cc_outputs)
+
+def build_ub_sanitized(clang: str, file: Path, flags: str, cc_timeout: int) -> Optional[Path]:
+    binary = scratch_binary("test")
+    cmd = [resolve_tool(clang), str(file), "-O0", "-fsanitize=undefined,address"] + flags.split()
+    cmd.append(f"-o{binary}")
+    try:
+        subprocess.run(cmd, stdout=_DEVNULL_FD, stderr=_DEVNULL_FD, close_fds=False, timeout=cc_timeout, check=True)
+        return binary
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        discard_binary(binary)
+        return None
+
+def run_ub_sanitized(binary: Path, exe_timeout: int) -> bool:
+    try:
+        subprocess.run(str(binary), stdout=_DEVNULL_FD, stderr=_DEVNULL_FD, close_fds=False, timeout=exe_timeout, check=True)
+        return True
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return False
 
-    if clang_rc != 0 or gcc_rc != 0:
+@lru_cache(maxsize=128)
+def use_ub_sanitizers(clang: str, file: Path, file_mtime: int, flags: str, cc_timeout: int, exe_timeout: int) -> bool:
+    binary = build_ub_sanitized(clang, file, flags, cc_timeout)
+    if binary is None:
         return False
+    try:
+        return run_ub_sanitized(binary, exe_timeout)
+    finally:
+        discard_binary(binary)
 
-    warnings = [
-        "conversions than data arguments",
-        "incompatible redeclaration",
-        "ordered comparison between pointer",
-        "eliding middle term",
-        "end of non-void function",
-        "invalid in C99",
-        "specifies type",
-        "should return a value",
-        "uninitialized",
-        "incompatible pointer to",
-        "incompatible integer to",
-        "comparison of distinct pointer types",
-        "type specifier missing",
-        "uninitialized",
-        "Wimplicit-int",
-        "division by zero",
-        "without a cast",
-        "control reaches end",
-        "return type defaults",
-        "cast from pointer to integer",
-        "useless type name in empty declaration",
-        "no semicolon at end",
-        "type defaults to",
-        "too few arguments for format",
-        "incompatible pointer",
-        "ordered comparison of pointer with integer",
-        "declaration does not declare anything",
-        "expects type",
-        "comparison of distinct pointer types",
-        "pointer from integer",
-        "incompatible implicit",
-        "excess elements in struct initializer",
-        "comparison between pointer and integer",
-        "return type of 'main' is not 'int'",
-        "past the end of the array",
-        "no return statement in function returning non-void",
-        "undefined behavior",
-    ]
-
-    return not any(w in clang_output or w in gcc_output for w in warnings)
+def sanitize(gcc: str, clang: str, file: Path, flags: str, cc_timeout: int = 8, exe_timeout: int = 2) -> bool:
+    try:
+        file_mtime = file.stat().st_mtime_ns
+    except OSError:
+        return False
+    # The two warning builds and the sanitizer build+run are independent and only wait
+    # on their subprocess, so start all three at once and only then look at the results
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        clang_future = executor.submit(get_cc_output, clang, file, file_mtime, flags, cc_timeout)
+        gcc_future = executor.submit(get_cc_output, gcc, file, file_mtime, flags, cc_timeout)
+        ub_future = executor.submit(use_ub_sanitizers, clang, file, file_mtime, flags, cc_timeout, exe_timeout)
+        return warning_free(clang_future.result(), gcc_future.result()) and ub_future.result()
 
 @lru_cache(maxsize=128)
-def use_ub_sanitizers(clang: str, file: Path, flags: str, cc_timeout: int, exe_timeout: int) -> bool:
-    cmd = [clang, str(file), "-O0", "-fsanitize=undefined,address"] + flags.split()
+def static_check(file_path: Path, file_mtime: int) -> Tuple[bool, bool, bool, bool]:
+    with open(file_path, 'r') as f:
+        code = f.read()
+    return (
+        '*' in code,
+        'struct' in code,
+        'union' in code,
+        bool(re.search(r'\w+\s*\[[^\]]*\]', code))
+    )
 
-    with temp_directory() as tmpdir:
-        binary = tmpdir / "test.out"
-        cmd.append(f"-o{binary}")
-        
+@lru_cache(maxsize=128)
+def dynamic_check(clang: str, llvm_dwarfdump: str, file_path: Path, file_mtime: int) -> Tuple[bool, bool, bool, bool]:
+    binary_file = scratch_binary("test_program")
+    cmd = [resolve_tool(clang), "-I/usr/local/include/", "-g", "-O2", str(file_path), "-o", str(binary_file)]
+    try:
         try:
-            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=cc_timeout, check=True)
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-            return False
+            subprocess.run(cmd, check=True, stdout=_DEVNULL_FD, stderr=_DEVNULL_FD, close_fds=False)
+        except subprocess.CalledProcessError:
+            return False, False, False, False
 
-        try:
-            subprocess.run(str(binary), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=exe_timeout, check=True)
-            return True
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-            return False
+        dwarfdump_cmd = [resolve_tool(llvm_dwarfdump), "--debug-info", str(binary_file) + ".dSYM"]
+        dwarfdump_output = subprocess.run(dwarfdump_cmd, capture_output=True, close_fds=False, text=True).stdout
 
-def sanitize(gcc: str, clang: str, file: Path, flags: str, cc_timeout: int = 8, exe_timeout: int = 2) -> bool:
-    return (check_compiler_warnings(gcc, clang, file, flags, cc_timeout) and
-            use_ub_sanitizers(clang, file, flags, cc_timeout, exe_timeout))
+        return (
+            "*" in dwarfdump_output or "DW_TAG_pointer_type" in dwarfdump_output,
+            "DW_TAG_structure_type" in dwarfdump_output,
+            "DW_TAG_union_type" in dwarfdump_output,
+            "DW_TAG_array_type" in dwarfdump_output
+        )
+    finally:
+        discard_binary(binary_file)
 
 class Checker:
     def __init__(self):
@@ -124,37 +196,15 @@ class Checker:
     def is_without_undefined_behavior(self, case: Path) -> bool:
         return sanitize(self.gcc, self.clang, case, "-g")
 
-    @lru_cache(maxsize=128)
     def static_check(self, file_path: Path) -> Tuple[bool, bool, bool, bool]:
-        with open(file_path, 'r') as f:
-            code = f.read()
-        return (
-            '*' in code,
-            'struct' in code,
-            'union' in code,
-            bool(re.search(r'\w+\s*\[[^\]]*\]', code))
-        )
+        return static_check(file_path, file_path.stat().st_mtime_ns)
 
-    @lru_cache(maxsize=128)
     def dynamic_check(self, file_path: Path) -> Tuple[bool, bool, bool, bool]:
-        with temp_directory() as temp_dir:
-            binary_file = temp_dir / "test_program"
-            cmd = [self.clang, "-I/usr/local/include/", "-g", "-O2", str(file_path), "-o", str(binary_file)]
-            
-            try:
-                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            except subprocess.CalledProcessError:
-                return False, False, False, False
-
-            dwarfdump_cmd = [self.llvm_dwarfdump, "--debug-info", str(binary_file) + ".dSYM"]
-            dwarfdump_output = subprocess.run(dwarfdump_cmd, capture_output=True, text=True).stdout
-
-            return (
-                "*" in dwarfdump_output or "DW_TAG_pointer_type" in dwarfdump_output,
-                "DW_TAG_structure_type" in dwarfdump_output,
-                "DW_TAG_union_type" in dwarfdump_output,
-                "DW_TAG_array_type" in dwarfdump_output
-            )
+        try:
+            file_mtime = file_path.stat().st_mtime_ns
+        except OSError:
+            return False, False, False, False
+        return dynamic_check(self.clang, self.llvm_dwarfdump, file_path, file_mtime)
 
     def is_interesting_with_pointers(self, case: Path) -> bool:
         return self.static_check(case)[0] and self.dynamic_check(case)[0]
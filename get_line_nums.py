@@ -3,15 +3,43 @@ import sys
 import re
 import subprocess
 import importlib.util
-from typing import List, Optional, Dict, Any, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Dict, Any, Tuple, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
 import platform
 
+from utils import resolve_tool
+
+try:
+    from elftools.common.exceptions import DWARFError, ELFError
+    from elftools.construct import ConstructError
+    from elftools.elf.elffile import ELFFile
+    # pyelftools reports DWARF it cannot decode (e.g. an unknown DWARF 5 form) through
+    # its own errors as well as plain lookup/value errors; all of these fall back
+    ELF_READ_ERRORS = (ELFError, DWARFError, ConstructError, KeyError, IndexError, ValueError)
+except ImportError:  # pyelftools is optional; without it we parse llvm-dwarfdump output
+    ELFFile = None
+    ELF_READ_ERRORS = ()
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 IS_MACOS = platform.system() == "Darwin"
 
+# Line table row flags, parsed once into a bitmask per row
+IS_STMT = 1 << 0
+BASIC_BLOCK = 1 << 1
+END_SEQUENCE = 1 << 2
+PROLOGUE_END = 1 << 3
+EPILOGUE_BEGIN = 1 << 4
+LINE_FLAGS = {
+    'is_stmt': IS_STMT,
+    'basic_block': BASIC_BLOCK,
+    'end_sequence': END_SEQUENCE,
+    'prologue_end': PROLOGUE_END,
+    'epilogue_begin': EPILOGUE_BEGIN,
+}
+_LINE_FLAG_TOKENS = {name.encode(): bit for name, bit in LINE_FLAGS.items()}
+
 class LLDBInterface:
     @staticmethod
     def load():
@@ -35,19 +63,31 @@ class DwarfDumpParser:
     @staticmethod
     def run_dwarfdump(binary_file: str, debug_info: bool = False) -> str:
         debug_file = DwarfDumpParser.get_debug_file_path(binary_file)
-        cmd = ["llvm-dwarfdump"]
+        cmd = [resolve_tool("llvm-dwarfdump")]
         if debug_info:
             cmd.append("--debug-info")
         else:
             cmd.append("--debug-line")
         cmd.append(debug_file)
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            result = subprocess.run(cmd, capture_output=True, close_fds=False, text=True, check=True)
             return result.stdout
         except subprocess.CalledProcessError as e:
             logging.error(f"Failed to run dwarfdump on {debug_file}: {e}")
             raise
 
+    @staticmethod
+    def stream_debug_line(binary_file: str) -> Iterator[bytes]:
+        """Yield the `--debug-line` dump as raw byte lines while llvm-dwarfdump is still writing it."""
+        debug_file = DwarfDumpParser.get_debug_file_path(binary_file)
+        cmd = [resolve_tool("llvm-dwarfdump"), "--debug-line", debug_file]
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, close_fds=False) as proc:
+            yield from proc.stdout
+        if proc.returncode != 0:
+            e = subprocess.CalledProcessError(proc.returncode, cmd)
+            logging.error(f"Failed to run dwarfdump on {debug_file}: {e}")
+            raise e
+
     @staticmethod
     def get_source_files(binary_file: str) -> List[str]:
         output = DwarfDumpParser.run_dwarfdump(binary_file, debug_info=True)
@@ -55,42 +95,44 @@ class DwarfDumpParser:
         return [os.path.basename(match.group(1)) for match in compile_unit_pattern.finditer(output)]
 
     @staticmethod
-    def parse_debug_line(output: str) -> Tuple[Dict[int, Dict[str, Any]], List[Dict[str, Any]]]:
+    def parse_debug_line(lines: Iterable[bytes]) -> Tuple[Dict[int, Dict[str, Any]], List[Dict[str, Any]]]:
+        # One pass over the raw dump, dispatching on line prefixes instead of running
+        # regexes against every row of what can be several MB of output.
         file_table = {}
         line_info = []
         current_file = None
-        
-        file_table_pattern = re.compile(r'file_names\[\s*(\d+)\]:')
-        file_name_pattern = re.compile(r'name: "(.+)"')
-        dir_index_pattern = re.compile(r'dir_index: (\d+)')
-        line_entry_pattern = re.compile(r'0x([0-9a-f]+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(.*)')
-
         parsing_file_table = False
 
-        for line in output.split('\n'):
-            if line.startswith("file_names["):
+        for line in lines:
+            if line.startswith(b"file_names["):
                 parsing_file_table = True
-                if match := file_table_pattern.search(line):
-                    current_file = int(match.group(1))
-                    file_table[current_file] = {}
+                current_file = int(line[11:line.index(b"]")])
+                file_table[current_file] = {}
             elif parsing_file_table:
-                if match := file_name_pattern.search(line):
-                    file_table[current_file]['name'] = match.group(1)
-                elif match := dir_index_pattern.search(line):
-                    file_table[current_file]['dir_index'] = int(match.group(1))
+                field = line.lstrip()
+                if field.startswith(b"name:"):
+                    start, end = field.find(b'"'), field.rfind(b'"')
+                    if start < end:
+                        file_table[current_file]['name'] = field[start + 1:end].decode('utf-8', 'replace')
+                elif field.startswith(b"dir_index:"):
+                    file_table[current_file]['dir_index'] = int(field[10:])
                     parsing_file_table = False
-            elif line.startswith("Address"):
+            elif line.startswith(b"Address"):
                 parsing_file_table = False
-            elif match := line_entry_pattern.search(line):
-                address, line_num, column, file_num, isa, discriminator, flags = match.groups()
+            elif line.startswith(b"0x"):
+                fields = line.split(None, 6)
+                if len(fields) == 6:  # row without any flags
+                    fields.append(b"")
+                elif len(fields) < 6:
+                    continue
+                flag_bits = 0
+                for token in fields[6].split():
+                    flag_bits |= _LINE_FLAG_TOKENS.get(token, 0)
                 line_info.append({
-                    'address': int(address, 16),
-                    'line': int(line_num),
-                    'column': int(column),
-                    'file': int(file_num),
-                    'isa': int(isa),
-                    'discriminator': int(discriminator),
-                    'flags': flags.strip()
+                    'address': int(fields[0], 16),
+                    'line': int(fields[1]),
+                    'file': int(fields[3]),
+                    'flags': flag_bits
                 })
    
         return file_table, line_info
@@ -101,20 +143,106 @@ class DwarfDumpParser:
         line_numbers_by_file = {}
         for entry in line_info:
             file_name = os.path.basename(file_table.get(entry['file'], {}).get('name', ''))
-            if file_name and 'is_stmt' in entry['flags']:
+            if file_name and entry['flags'] & IS_STMT:
                 if file_name not in line_numbers_by_file:
                     line_numbers_by_file[file_name] = set()
                 line_numbers_by_file[file_name].add(entry['line'])
         
         return {file: sorted(lines) for file, lines in line_numbers_by_file.items()}
 
+class ElfLineTableReader:
+    """Reads .debug_line straight from an ELF binary with pyelftools, skipping llvm-dwarfdump."""
+
+    @staticmethod
+    def is_available() -> bool:
+        return ELFFile is not None and not IS_MACOS
+
+    @staticmethod
+    def read(binary_file: str) -> Tuple[List[str], Dict[int, Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Returns the compile unit names plus a file table and line info shaped like
+        DwarfDumpParser.parse_debug_line's. File indices are renumbered globally so
+        entries from different compile units never collide.
+        """
+        source_files = []
+        file_table = {}
+        line_info = []
+
+        with open(binary_file, 'rb') as f:
+            dwarf_info = ELFFile(f).get_dwarf_info()
+            for cu in dwarf_info.iter_CUs():
+                name_attr = cu.get_top_DIE().attributes.get('DW_AT_name')
+                if name_attr is not None:
+                    source_files.append(os.path.basename(name_attr.value.decode('utf-8', 'replace')))
+
+                line_program = dwarf_info.line_program_for_CU(cu)
+                if line_program is None:
+                    continue
+                # DWARF 5 file indices are 0-based, earlier versions are 1-based
+                first_index = 0 if line_program.header.version >= 5 else 1
+                file_ids = {}
+                for i, file_entry in enumerate(line_program.header.file_entry, start=first_index):
+                    file_ids[i] = len(file_table)
+                    file_table[len(file_table)] = {
+                        'name': file_entry.name.decode('utf-8', 'replace'),
+                        'dir_index': file_entry.dir_index,
+                    }
+
+                for entry in line_program.get_entries():
+                    state = entry.state
+                    if state is None:
+                        continue
+                    flag_bits = 0
+                    for name, bit in LINE_FLAGS.items():
+                        if getattr(state, name, False):
+                            flag_bits |= bit
+                    line_info.append({
+                        'address': state.address,
+                        'line': state.line,
+                        'file': file_ids.get(state.file, -1),
+                        'flags': flag_bits
+                    })
+
+        return source_files, file_table, line_info
+
 class LineNumberVerifier:
     def __init__(self, lldb):
         self.lldb = lldb
 
+    def resolve_line_nums(self, source_file: str, file_path: str, line_numbers: List[int]) -> Optional[List[int]]:
+        """
+        Statically keep the lines whose breakpoint resolves to an address on that same
+        line, without launching the binary.
+        """
+        debugger = self.lldb.SBDebugger.Create()
+        try:
+            target = debugger.CreateTargetWithFileAndArch(file_path, self.lldb.LLDB_ARCH_DEFAULT)
+            if not target.IsValid():
+                logging.error("Target is not valid")
+                return None
+
+            resolved_line_nums = []
+            for line_number in line_numbers:
+                bp = target.BreakpointCreateByLocation(source_file, line_number)
+                if not bp.IsValid():
+                    logging.warning(f"Could not create breakpoint at line {line_number}")
+                    continue
+                for i in range(bp.GetNumLocations()):
+                    line_entry = bp.GetLocationAtIndex(i).GetAddress().GetLineEntry()
+                    if line_entry.GetLine() == line_number:
+                        resolved_line_nums.append(line_number)
+                        break
+            return resolved_line_nums
+        except Exception as e:
+            logging.error(f"Error in resolve_line_nums: {str(e)}")
+            return None
+        finally:
+            self.lldb.SBDebugger.Destroy(debugger)
+
     def verify_line_nums(self, source_file: str, file_path: str, line_numbers: List[int]) -> Optional[List[int]]:
         debugger = self.lldb.SBDebugger.Create()
         debugger.SetAsync(False)
+        target = process = None
         
         try:
             target = debugger.CreateTargetWithFileAndArch(file_path, self.lldb.LLDB_ARCH_DEFAULT)
@@ -123,12 +251,12 @@ class LineNumberVerifier:
                 return None
 
             verified_line_nums = set()
-            breakpoints = []
+            breakpoint_lines = {}  # breakpoint id -> requested line
 
             for line_number in line_numbers:
                 bp = target.BreakpointCreateByLocation(source_file, line_number)
                 if bp.IsValid():
-                    breakpoints.append((bp, line_number))
+                    breakpoint_lines[bp.GetID()] = line_number
                 else:
                     logging.warning(f"Could not create breakpoint at line {line_number}")
 
@@ -142,9 +270,11 @@ class LineNumberVerifier:
                 if thread.GetStopReason() == self.lldb.eStopReasonBreakpoint:
                     frame = thread.GetFrameAtIndex(0)
                     line_number_hit = frame.GetLineEntry().GetLine()
-                    for bp, line_number in breakpoints:
-                        if bp.GetHitCount() > 0 and line_number == line_number_hit:
-                            verified_line_nums.add(line_number)
+                    # Stop reason data holds (breakpoint id, location id) pairs for every
+                    # breakpoint at this pc, so only those need looking at
+                    for i in range(0, thread.GetStopReasonDataCount(), 2):
+                        if breakpoint_lines.get(thread.GetStopReasonDataAtIndex(i)) == line_number_hit:
+                            verified_line_nums.add(line_number_hit)
                             break
                 process.Continue()
 
@@ -158,10 +288,10 @@ class LineNumberVerifier:
 
     def _cleanup(self, debugger, target, process):
         try:
-            if 'process' in locals() and process.IsValid():
+            if process is not None and process.IsValid():
                 process.Kill()
                 process.Destroy()
-            if 'target' in locals() and target.IsValid():
+            if target is not None and target.IsValid():
                 target.DeleteAllBreakpoints()
                 debugger.DeleteTarget(target)
         except Exception as cleanup_error:
@@ -169,21 +299,41 @@ class LineNumberVerifier:
         self.lldb.SBDebugger.Destroy(debugger)
 
 class LineNumberExtractor:
-    def __init__(self):
-        self.lldb = LLDBInterface.load()
-        self.verifier = LineNumberVerifier(self.lldb)
+    def __init__(self, verify: bool = False, launch: bool = True):
+        # The is_stmt rows of the line table already mark the breakpoint-capable lines.
+        # verify=True runs the binary once under LLDB and keeps only the lines that are
+        # hit; with launch=False it only checks that each line resolves, without running
+        self.verify = verify
+        self.launch = launch
+        self.lldb = LLDBInterface.load() if verify else None
+        self.verifier = LineNumberVerifier(self.lldb) if verify else None
+
+    @staticmethod
+    def read_line_tables(binary_file: str) -> Tuple[List[str], Dict[int, Dict[str, Any]], List[Dict[str, Any]]]:
+        if ElfLineTableReader.is_available():
+            try:
+                return ElfLineTableReader.read(binary_file)
+            except ELF_READ_ERRORS as e:
+                logging.warning(f"Falling back to llvm-dwarfdump for {binary_file}: {e}")
+        source_files = DwarfDumpParser.get_source_files(binary_file)
+        debug_lines = DwarfDumpParser.stream_debug_line(binary_file)
+        file_table, line_info = DwarfDumpParser.parse_debug_line(debug_lines)
+        return source_files, file_table, line_info
 
     def get_line_nums(self, binary_file: str) -> Dict[str, List[int]]:
         try:
-            source_files = DwarfDumpParser.get_source_files(binary_file)
-            dwarfdump_output = DwarfDumpParser.run_dwarfdump(binary_file)
-            file_table, line_info = DwarfDumpParser.parse_debug_line(dwarfdump_output)
+            source_files, file_table, line_info = self.read_line_tables(binary_file)
             line_numbers_by_file = DwarfDumpParser.get_line_numbers_by_file(file_table, line_info)
             
             verified_line_numbers = {}
             for source_file, line_numbers in line_numbers_by_file.items():
                 if source_file in source_files:  # Only verify for compile units
-                    verified_lines = self.verifier.verify_line_nums(source_file, binary_file, line_numbers)
+                    if not self.verify:
+                        verified_line_numbers[source_file] = line_numbers
+                        continue
+                    verify_line_nums = (self.verifier.verify_line_nums if self.launch
+                                        else self.verifier.resolve_line_nums)
+                    verified_lines = verify_line_nums(source_file, binary_file, line_numbers)
                     if verified_lines:
                         verified_line_numbers[source_file] = verified_lines
             
@@ -192,20 +342,21 @@ class LineNumberExtractor:
             logging.error(f"Error in get_line_nums: {str(e)}")
             return {}
 
-def process_binary(extractor: LineNumberExtractor, binary_file: str) -> Tuple[str, Dict[str, List[int]]]:
-    line_nums_by_file = extractor.get_line_nums(binary_file)
+def process_binary(binary_file: str, verify: bool) -> Tuple[str, Dict[str, List[int]]]:
+    # One binary per process: with verify, each gets its own LLDB instead of sharing one
+    line_nums_by_file = LineNumberExtractor(verify=verify).get_line_nums(binary_file)
     return binary_file, line_nums_by_file
 
 def main():
-    if len(sys.argv) < 2:
-        logging.error(f"Usage: {sys.argv[0]} <binary_file1> [<binary_file2> ...]")
+    # Lines are verified under LLDB as before unless --no-verify is given
+    verify = "--no-verify" not in sys.argv[1:]
+    binary_files = [arg for arg in sys.argv[1:] if arg != "--no-verify"]
+    if not binary_files:
+        logging.error(f"Usage: {sys.argv[0]} [--no-verify] <binary_file1> [<binary_file2> ...]")
         sys.exit(1)
-
-    binary_files = sys.argv[1:]
-    extractor = LineNumberExtractor()
     
-    with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_binary, extractor, binary_file) for binary_file in binary_files]
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(process_binary, binary_file, verify) for binary_file in binary_files]
         
         for future in as_completed(futures):
             binary_file, line_nums_by_file = future.result()
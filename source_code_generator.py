@@ -1,151 +1,202 @@
+import asyncio
+import atexit
 import tempfile
 import subprocess
 import logging
 import os
+import re
+import shutil
 import sys
 import multiprocessing
-from random import randint
+import random
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import ClassVar, Optional, List, Tuple
 from tempfile import NamedTemporaryFile
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from utils import resolve_tool
+
+WARNINGS = (
+    b"conversions than data arguments", b"incompatible redeclaration",
+    b"ordered comparison between pointer", b"eliding middle term",
+    b"end of non-void function", b"invalid in C99", b"specifies type",
+    b"should return a value", b"uninitialized", b"incompatible pointer to",
+    b"incompatible integer to", b"comparison of distinct pointer types",
+    b"type specifier missing", b"Wimplicit-int", b"division by zero",
+    b"without a cast", b"control reaches end", b"return type defaults",
+    b"cast from pointer to integer", b"useless type name in empty declaration",
+    b"no semicolon at end", b"type defaults to", b"too few arguments for format",
+    b"incompatible pointer", b"ordered comparison of pointer with integer",
+    b"declaration does not declare anything", b"expects type",
+    b"pointer from integer", b"incompatible implicit",
+    b"excess elements in struct initializer",
+    b"comparison between pointer and integer",
+    b"return type of 'main' is not 'int'", b"past the end of the array",
+    b"no return statement in function returning non-void",
+    b"undefined behavior",
+)
+# Built once at import so each candidate's compiler output is scanned in a single pass.
+# Patterns are bytes so the output is matched as the compiler wrote it, without decoding.
+WARNINGS_RE = re.compile(b"|".join(re.escape(w) for w in WARNINGS))
+
+# Candidates and sanitizer binaries are written here; tmpfs keeps them off the disk.
+# The binaries get executed, so a noexec /dev/shm falls back to the default temp dir.
+TMPFS_DIR = ("/dev/shm" if os.path.isdir("/dev/shm") and not os.statvfs("/dev/shm").f_flag & os.ST_NOEXEC
+             else None)
+
+# Without CompCert installed every interpreter run would just fail, so the step is skipped.
+# resolve_tool falls back to the bare name when the tool is not on PATH.
+_HAS_CCOMP = resolve_tool("ccomp") != "ccomp"
+
+_CSMITH_OPTIONS = (
+    "arrays", "bitfields", "checksum", "comma-operators",
+    "compound-assignment", "consts", "divs", "embedded-assigns",
+    "jumps", "longlong", "force-non-uniform-arrays", "math64",
+    "muls", "packed-struct", "paranoid", "pointers", "structs",
+    "inline-function", "return-structs", "arg-structs",
+    "dangling-global-pointers",
+)
+_OPT_PAIRS = tuple((f"--{option}", f"--no-{option}") for option in _CSMITH_OPTIONS)
+# Fixed flags following the csmith path
+_CSMITH_BASE = ("--no-unions", "--safe-math", "--no-argc", "--no-volatiles", "--no-volatile-pointers")
+
 class CompilationEnvironment:
     def __init__(self) -> None:
         self.temp_dir: Optional[tempfile.TemporaryDirectory] = None
 
     def __enter__(self) -> Path:
-        self.temp_dir = tempfile.TemporaryDirectory()
-        tempfile.tempdir = self.temp_dir.name
+        self.temp_dir = tempfile.TemporaryDirectory(dir=TMPFS_DIR)
         return Path(self.temp_dir.name)
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
-        tempfile.tempdir = None
         if self.temp_dir:
             self.temp_dir.cleanup()
 
 class Compiler:
     @staticmethod
-    def run_command(cmd: List[str], timeout: int) -> Tuple[int, str]:
+    def run_command(cmd: List[str], timeout: int, capture: bool = True) -> Tuple[int, bytes]:
+        # Output nobody reads goes to /dev/null instead of through a pipe.
+        # Captured output is read in full; cutting it short could hide a warning.
+        stdout = subprocess.PIPE if capture else subprocess.DEVNULL
+        stderr = subprocess.STDOUT if capture else subprocess.DEVNULL
         try:
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, text=True)
-            return result.returncode, result.stdout
+            result = subprocess.run(cmd, stdout=stdout, stderr=stderr, timeout=timeout)
+            return result.returncode, result.stdout or b""
         except subprocess.TimeoutExpired:
-            return 1, "Compilation timed out"
-        except subprocess.CalledProcessError as e:
-            return e.returncode, e.output
+            return 1, b"Compilation timed out"
 
     @staticmethod
-    def check_warnings(cfile: Path, flags: str, timeout: int) -> bool:
+    def warnings_command(cfile: Path, flags: str) -> List[str]:
+        # The warnings we look for all come from clang's frontend, so skip codegen entirely
         cmd = [
-            "clang", str(cfile), "-c", "-o/dev/null", "-Wall", "-Wextra", "-Wpedantic",
-            "-O3", "-Wno-builtin-declaration-mismatch"
+            resolve_tool("clang"), str(cfile), "-fsyntax-only", "-Wall", "-Wextra", "-Wpedantic",
+            "-Wno-builtin-declaration-mismatch"
         ]
         if flags:
             cmd.extend(flags.split())
-        
-        returncode, output = Compiler.run_command(cmd, timeout)
+        return cmd
+
+    @staticmethod
+    def has_warnings(output: bytes) -> bool:
+        return WARNINGS_RE.search(output) is not None
+
+    @staticmethod
+    def check_warnings(cfile: Path, flags: str, timeout: int) -> bool:
+        returncode, output = Compiler.run_command(Compiler.warnings_command(cfile, flags), timeout)
         if returncode != 0:
             return False
 
-        warnings = [
-            "conversions than data arguments", "incompatible redeclaration",
-            "ordered comparison between pointer", "eliding middle term",
-            "end of non-void function", "invalid in C99", "specifies type",
-            "should return a value", "uninitialized", "incompatible pointer to",
-            "incompatible integer to", "comparison of distinct pointer types",
-            "type specifier missing", "Wimplicit-int", "division by zero",
-            "without a cast", "control reaches end", "return type defaults",
-            "cast from pointer to integer", "useless type name in empty declaration",
-            "no semicolon at end", "type defaults to", "too few arguments for format",
-            "incompatible pointer", "ordered comparison of pointer with integer",
-            "declaration does not declare anything", "expects type",
-            "pointer from integer", "incompatible implicit",
-            "excess elements in struct initializer",
-            "comparison between pointer and integer",
-            "return type of 'main' is not 'int'", "past the end of the array",
-            "no return statement in function returning non-void",
-            "undefined behavior"
-        ]
+        return not Compiler.has_warnings(output)
 
-        return not any(w in output for w in warnings)
+    @staticmethod
+    def sanitizer_command(cfile: Path, flags: str, exe_path: Path) -> List[str]:
+        cmd = [resolve_tool("clang"), str(cfile), "-O0", "-fsanitize=undefined,address", f"-o{exe_path}"]
+        if flags:
+            cmd.extend(flags.split())
+        return cmd
 
     @staticmethod
-    def use_sanitizers(cfile: Path, flags: str, cc_timeout: int, exe_timeout: int) -> bool:
-        with CompilationEnvironment() as temp_dir:
-            exe_path = temp_dir / "test.out"
-            compile_cmd = ["clang", str(cfile), "-O0", "-fsanitize=undefined,address", f"-o{exe_path}"]
-            if flags:
-                compile_cmd.extend(flags.split())
-            
-            returncode, _ = Compiler.run_command(compile_cmd, cc_timeout)
-            if returncode != 0:
-                return False
-            
-            exe_cmd = [str(exe_path)]
-            returncode, _ = Compiler.run_command(exe_cmd, exe_timeout)
-            return returncode == 0
+    def use_sanitizers(cfile: Path, flags: str, cc_timeout: int, exe_timeout: int,
+                       work_dir: Optional[Path] = None) -> bool:
+        if work_dir is None:
+            with CompilationEnvironment() as temp_dir:
+                return Compiler.use_sanitizers(cfile, flags, cc_timeout, exe_timeout, temp_dir)
+
+        exe_path = work_dir / "test.out"
+        compile_cmd = Compiler.sanitizer_command(cfile, flags, exe_path)
+        returncode, _ = Compiler.run_command(compile_cmd, cc_timeout, capture=False)
+        if returncode != 0:
+            return False
+        
+        exe_cmd = [str(exe_path)]
+        returncode, _ = Compiler.run_command(exe_cmd, exe_timeout, capture=False)
+        return returncode == 0
 
     @staticmethod
-    def verify_with_compcert(cfile: Path, flags: str, timeout: int) -> bool:
-        cmd = ["ccomp", str(cfile), "-interp", "-fall"]
+    def compcert_command(cfile: Path, flags: str) -> List[str]:
+        cmd = [resolve_tool("ccomp"), str(cfile), "-interp", "-fall"]
         if flags:
             cmd.extend(flags.split())
-        
-        returncode, _ = Compiler.run_command(cmd, timeout)
+        return cmd
+
+    @staticmethod
+    def verify_with_compcert(cfile: Path, flags: str, timeout: int) -> bool:
+        if not _HAS_CCOMP:
+            return True
+        returncode, _ = Compiler.run_command(Compiler.compcert_command(cfile, flags), timeout, capture=False)
         return returncode == 0
 
 class CodeGenerator:
     @staticmethod
-    def run_csmith() -> str:
-        options = [
-            "arrays", "bitfields", "checksum", "comma-operators",
-            "compound-assignment", "consts", "divs", "embedded-assigns",
-            "jumps", "longlong", "force-non-uniform-arrays", "math64",
-            "muls", "packed-struct", "paranoid", "pointers", "structs",
-            "inline-function", "return-structs", "arg-structs",
-            "dangling-global-pointers"
-        ]
-
-        cmd = [
-            "csmith", "--no-unions", "--safe-math", "--no-argc",
-            "--no-volatiles", "--no-volatile-pointers"
-        ]
-        cmd.extend(f"--{'no-' if randint(0, 1) else ''}{option}" for option in options)
+    def csmith_command() -> List[str]:
+        # One random bit per option picks its --x / --no-x spelling
+        bits = random.getrandbits(len(_OPT_PAIRS))
+        return [resolve_tool("csmith"), *_CSMITH_BASE, *(pair[(bits >> i) & 1] for i, pair in enumerate(_OPT_PAIRS))]
 
+    @staticmethod
+    def run_csmith(work_dir: Optional[Path] = None) -> Path:
+        # csmith writes straight into the candidate file; its path is returned
+        cmd = CodeGenerator.csmith_command()
         for _ in range(10):  # Try up to 10 times
-            returncode, output = Compiler.run_command(cmd, timeout=30)
+            with NamedTemporaryFile(suffix=".c", delete=False, dir=work_dir or TMPFS_DIR) as ntf:
+                try:
+                    returncode = subprocess.run(cmd, stdout=ntf, stderr=subprocess.DEVNULL, timeout=30).returncode
+                except subprocess.TimeoutExpired:
+                    returncode = 1
             if returncode == 0:
-                return output
+                return Path(ntf.name)
+            os.unlink(ntf.name)
         
         raise RuntimeError("CSmith failed 10 times in a row!")
 
     @staticmethod
     def generate_interesting_case(min_size: int = 4000, max_size: int = 30000, 
-                                  additional_flags: str = "") -> str:
+                                  additional_flags: str = "", work_dir: Optional[Path] = None) -> Path:
         while True:
+            candidate = CodeGenerator.run_csmith(work_dir)
             try:
-                candidate = CodeGenerator.run_csmith()
-                if min_size <= len(candidate) <= max_size:
-                    with NamedTemporaryFile(suffix=".c", mode='w') as ntf:
-                        ntf.write(candidate)
-                        ntf.flush()
-                        if Sanitizer.sanitize(Path(ntf.name), additional_flags):
-                            return candidate
-                        
+                if (min_size <= os.stat(candidate).st_size <= max_size
+                        and Sanitizer.sanitize(candidate, additional_flags, work_dir=work_dir)):
+                    return candidate
             except subprocess.TimeoutExpired:
                 logging.warning("Timeout occurred during code generation")
+            except BaseException:
+                candidate.unlink()
+                raise
+            candidate.unlink()
 
 class Sanitizer:
     @staticmethod
     def sanitize(file: Path, flags: str, cc_timeout: int = 8, exe_timeout: int = 2, 
-                 compcert_timeout: int = 16) -> bool:
+                 compcert_timeout: int = 16, work_dir: Optional[Path] = None) -> bool:
+        # Cheapest gate first; a generator lets all() stop at the first rejection
+        checks = (
+            lambda: Compiler.check_warnings(file, flags, cc_timeout),
+            lambda: Compiler.use_sanitizers(file, flags, cc_timeout, exe_timeout, work_dir),
+            lambda: Compiler.verify_with_compcert(file, flags, compcert_timeout),
+        )
         try:
-            return all([
-                Compiler.check_warnings(file, flags, cc_timeout),
-                Compiler.use_sanitizers(file, flags, cc_timeout, exe_timeout),
-                Compiler.verify_with_compcert(file, flags, compcert_timeout)
-            ])
+            return all(check() for check in checks)
         except subprocess.TimeoutExpired:
             return False
 
@@ -168,38 +219,161 @@ class Sanitizer:
 #     main()
 
 class ParallelCodeGenerator:
+    # Shared by every instance so repeated generate_files calls don't pay pool startup again
+    _executor: ClassVar[Optional[ProcessPoolExecutor]] = None
+
     def __init__(self, output_dir: Path, num_processes: int = None):
         self.output_dir = output_dir
         self.num_processes = num_processes or multiprocessing.cpu_count()
         self.output_dir.mkdir(exist_ok=True)
 
-    def generate_file(self, file_index: int) -> Tuple[int, Optional[str]]:
+    def generate_file(self, file_index: int, work_dir: Optional[Path] = None) -> Tuple[int, Optional[str]]:
         try:
-            source_code = CodeGenerator.generate_interesting_case()
+            candidate = CodeGenerator.generate_interesting_case(work_dir=work_dir)
             output_file = self.output_dir / f"d_{file_index:05d}.c"
-            with open(output_file, 'w') as f:
-                f.write(source_code)
+            # A rename when on the same filesystem; tmpfs candidates are copied across
+            shutil.move(candidate, output_file)
             return file_index, None
         except Exception as e:
             return file_index, str(e)
 
+    def generate_file_batch(self, start: int, stop: int) -> List[Tuple[int, Optional[str]]]:
+        # A whole range per task: one handoff to the worker and one scratch directory
+        # for every candidate it tries, rather than per accepted file
+        with CompilationEnvironment() as work_dir:
+            return [self.generate_file(file_index, work_dir) for file_index in range(start, stop)]
+
+    @classmethod
+    def get_executor(cls, max_workers: int) -> ProcessPoolExecutor:
+        # forkserver workers start from a small clean process rather than a copy of ours.
+        # The pool is created on first use; later callers get it as sized then.
+        if cls._executor is None:
+            cls._executor = ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=multiprocessing.get_context("forkserver"))
+            atexit.register(cls._executor.shutdown)
+        return cls._executor
+
     def generate_files(self, num_files: int):
         logging.info(f"Generating {num_files} files using {self.num_processes} processes")
-        with ProcessPoolExecutor(max_workers=self.num_processes) as executor:
-            futures = [executor.submit(self.generate_file, i) for i in range(num_files)]
-            for future in as_completed(futures):
-                file_index, error = future.result()
+        executor = self.get_executor(self.num_processes)
+        num_batches = min(num_files, self.num_processes * 4) or 1
+        bounds = [num_files * i // num_batches for i in range(num_batches + 1)]
+        futures = [executor.submit(self.generate_file_batch, start, stop)
+                   for start, stop in zip(bounds, bounds[1:])]
+        for future in as_completed(futures):
+            for file_index, error in future.result():
                 if error:
                     logging.error(f"Error generating file {file_index}: {error}")
                 else:
                     logging.info(f"Successfully generated file {file_index}")
 
+class AsyncCodeGenerator:
+    """
+    Drives generation from one asyncio event loop instead of a pool of Python workers.
+
+    Every csmith/clang/ccomp invocation is awaited by the coroutine of the file it
+    belongs to, and a semaphore bounds how many external tools run at once.
+    """
+    def __init__(self, output_dir: Path, max_concurrency: int = None):
+        self.output_dir = output_dir
+        self.max_concurrency = max_concurrency or 2 * multiprocessing.cpu_count()
+        self.output_dir.mkdir(exist_ok=True)
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def run_command(self, cmd: List[str], timeout: int, capture: bool = True) -> Tuple[int, bytes]:
+        stdout = asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL
+        stderr = asyncio.subprocess.STDOUT if capture else asyncio.subprocess.DEVNULL
+        async with self.semaphore:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=stdout, stderr=stderr)
+            try:
+                output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                return 1, b"Compilation timed out"
+        return proc.returncode, output or b""
+
+    async def run_csmith(self) -> Path:
+        cmd = CodeGenerator.csmith_command()
+        for _ in range(10):  # Try up to 10 times
+            with NamedTemporaryFile(suffix=".c", delete=False, dir=TMPFS_DIR) as ntf:
+                async with self.semaphore:
+                    proc = await asyncio.create_subprocess_exec(*cmd, stdout=ntf, stderr=asyncio.subprocess.DEVNULL)
+                    try:
+                        returncode = await asyncio.wait_for(proc.wait(), 30)
+                    except asyncio.TimeoutError:
+                        proc.kill()
+                        await proc.wait()
+                        returncode = 1
+            if returncode == 0:
+                return Path(ntf.name)
+            os.unlink(ntf.name)
+
+        raise RuntimeError("CSmith failed 10 times in a row!")
+
+    async def sanitize(self, file: Path, flags: str, cc_timeout: int = 8, exe_timeout: int = 2,
+                       compcert_timeout: int = 16) -> bool:
+        returncode, output = await self.run_command(Compiler.warnings_command(file, flags), cc_timeout)
+        if returncode != 0 or Compiler.has_warnings(output):
+            return False
+
+        with CompilationEnvironment() as temp_dir:
+            exe_path = temp_dir / "test.out"
+            returncode, _ = await self.run_command(Compiler.sanitizer_command(file, flags, exe_path), cc_timeout, capture=False)
+            if returncode != 0:
+                return False
+            returncode, _ = await self.run_command([str(exe_path)], exe_timeout, capture=False)
+            if returncode != 0:
+                return False
+
+        if not _HAS_CCOMP:
+            return True
+        returncode, _ = await self.run_command(Compiler.compcert_command(file, flags), compcert_timeout, capture=False)
+        return returncode == 0
+
+    async def generate_interesting_case(self, min_size: int = 4000, max_size: int = 30000,
+                                        additional_flags: str = "") -> Path:
+        while True:
+            candidate = await self.run_csmith()
+            try:
+                if (min_size <= os.stat(candidate).st_size <= max_size
+                        and await self.sanitize(candidate, additional_flags)):
+                    return candidate
+            except BaseException:
+                candidate.unlink()
+                raise
+            candidate.unlink()
+
+    async def generate_file(self, file_index: int) -> Tuple[int, Optional[str]]:
+        try:
+            candidate = await self.generate_interesting_case()
+            output_file = self.output_dir / f"d_{file_index:05d}.c"
+            shutil.move(candidate, output_file)
+            return file_index, None
+        except Exception as e:
+            return file_index, str(e)
+
+    async def _generate_files(self, num_files: int):
+        # Created here so it belongs to the running event loop
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.create_task(self.generate_file(i)) for i in range(num_files)]
+        for task in asyncio.as_completed(tasks):
+            file_index, error = await task
+            if error:
+                logging.error(f"Error generating file {file_index}: {error}")
+            else:
+                logging.info(f"Successfully generated file {file_index}")
+
+    def generate_files(self, num_files: int):
+        logging.info(f"Generating {num_files} files with up to {self.max_concurrency} concurrent tool runs")
+        asyncio.run(self._generate_files(num_files))
+
 def main():
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     output_dir = Path("generated_code")
     num_files = 100  # Change this to the desired number of files
 
-    generator = ParallelCodeGenerator(output_dir)
+    generator = AsyncCodeGenerator(output_dir)
     generator.generate_files(num_files)
 
 if __name__ == '__main__':
@@ -1,10 +1,14 @@
+import fcntl
 import json
 import logging
+import operator
 import os
+import shutil
 import subprocess
 import tempfile
 import contextlib
 import importlib
+from functools import lru_cache
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, List, Dict, Optional
@@ -25,8 +29,22 @@ def find_c_files(directory):
         print(f"Error: {directory} is not a valid directory.")
         return []
     
-    c_files = sorted(list(dir_path.glob('**/*.c')))
+    # Walk with scandir: the entry type comes from the directory listing, so there is
+    # no stat per entry, and only the matches are turned into Path objects
+    c_files = []
+    stack = [dir_path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.c'):
+                        c_files.append(Path(entry.path))
+        except OSError:
+            continue
     
+    c_files.sort()
     return c_files
 
 def find_c_files_int(directory, start=None, end=None):
@@ -47,30 +65,33 @@ def find_c_files_int(directory, start=None, end=None):
         print(f"Error: {directory} is not a valid directory.")
         return []
     
-    # Find all .c files
-    all_c_files = list(dir_path.glob('*.c'))
-    
-    # Sort files based on their numeric prefix
-    sorted_c_files = sorted(all_c_files, key=lambda x: int(x.stem))
-    
-    # If start and end are specified, filter the list
-    if start is not None and end is not None:
-        filtered_c_files = [f for f in sorted_c_files if start <= int(f.stem) <= end]
-    elif start is not None:
-        filtered_c_files = [f for f in sorted_c_files if int(f.stem) >= start]
-    elif end is not None:
-        filtered_c_files = [f for f in sorted_c_files if int(f.stem) <= end]
-    else:
-        filtered_c_files = sorted_c_files
+    # One scandir pass: names without a numeric stem are skipped rather than parsed,
+    # and the entry type comes from the directory listing instead of a stat per file
+    numbered_c_files = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            name = entry.name
+            stem = name[:-2]
+            if name.endswith(".c") and stem.isascii() and stem.isdigit() and entry.is_file():
+                number = int(stem)
+                if (start is None or number >= start) and (end is None or number <= end):
+                    numbered_c_files.append((number, Path(entry.path)))
     
-    return filtered_c_files
+    numbered_c_files.sort(key=operator.itemgetter(0))
+    return [path for _, path in numbered_c_files]
 
+@lru_cache(maxsize=1)
+def _lldb_pythonpath() -> str:
+    # Spawning lldb just to print this path costs tens of milliseconds, so ask once
+    return subprocess.check_output(["lldb", "-P"], stderr=subprocess.STDOUT).rstrip().decode('utf-8')
+
+@lru_cache(maxsize=1)
 def load_lldb_interface():
     # Find the lldb module and load it into LLDB's Python interpreter.
-    lldb_executable = "lldb"
-    args = [lldb_executable, '-P']
-    pythonpath = subprocess.check_output(args, stderr=subprocess.STDOUT).rstrip().decode('utf-8')
-    sys.path.append(pythonpath)
+    # Memoized, so later callers share the module and sys.path only grows once.
+    pythonpath = _lldb_pythonpath()
+    if pythonpath not in sys.path:
+        sys.path.append(pythonpath)
     module = importlib.import_module('lldb')
     return module
 
@@ -81,6 +102,7 @@ def run_cmd(cmd: List[str], working_dir: Optional[Path] = None) -> str:
     result = subprocess.run(cmd, cwd=str(working_dir), check=True, capture_output=True, text=True)
     return result.stdout.strip()
 
+@lru_cache(maxsize=None)
 def get_compiler_version(compiler: str) -> Optional[str]:
     try:
         result = run_cmd([compiler, '--version'])
@@ -89,6 +111,16 @@ def get_compiler_version(compiler: str) -> Optional[str]:
         logging.error(f"Failed to get version for {compiler}")
         return None
 
+@lru_cache(maxsize=None)
+def resolve_tool(name: str) -> str:
+    """
+    Resolve an executable name to an absolute path, once per process.
+
+    subprocess only takes its posix_spawn fast path (instead of fork+exec) when the
+    executable has a directory component, so bare names like "clang" miss it.
+    """
+    return shutil.which(name) or name
+
 def check_installed_compilers() -> Dict[str, str]:
     compilers = {
         'gcc': 'gcc',
@@ -106,6 +138,52 @@ def save_to_tmp_file(content: str) -> tempfile.NamedTemporaryFile:
     tmp_file.flush()
     return tmp_file
 
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from <linux/fs.h>
+
+def fast_copy(src, dst) -> None:
+    """
+    Copy file contents only (no metadata) as cheaply as the platform allows.
+
+    Tries a copy-on-write clone (FICLONE on btrfs/XFS, no bytes copied), then an
+    in-kernel os.copy_file_range, and finally falls back to shutil.copyfileobj.
+    
+    Args:
+        src (str | Path): The file to copy.
+        dst (str | Path): The destination path, created or truncated.
+
+    Raises:
+        shutil.SameFileError: If src and dst are the same file, like shutil.copy2;
+            opening dst for writing would otherwise truncate src.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return
+        except OSError:
+            pass
+
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(src_fd).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining <= 0:
+                    return
+            except OSError:
+                pass
+            # Start over from scratch after a partial in-kernel copy
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+
+        shutil.copyfileobj(fsrc, fdst)
+
 
 
 import os
@@ -113,18 +191,35 @@ import sys
 import re
 import subprocess
 import importlib.util
-from typing import List, Optional, Dict, Any, Tuple
+import itertools
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Tuple
 import logging
 import platform
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 # Create a logger
 logger = logging.getLogger(__name__)
+
+# Every line of a --debug-line dump that parse_debug_line cares about, as one pattern.
+# The outer named groups tell the kinds apart through match.lastgroup.
+_DWARF_LINE_RE = re.compile(
+    r'(?P<hdr>file_names\[\s*(?P<hdr_idx>\d+)\]:)|'
+    r'(?P<name>name: "(?P<name_val>.+)")|'
+    r'(?P<dir>dir_index: (?P<dir_val>\d+))|'
+    r'(?P<table>^Address)|'
+    r'(?P<row>^0x[0-9a-f]+\s+(?P<ln>\d+)\s+\d+\s+(?P<fnum>\d+)\s+\d+\s+\d+\s+(?P<flags>.*))'
+)
+
 class LineNumberExtractor:
-    def __init__(self, lldb_path: Optional[str] = None):
+    def __init__(self, lldb_path: Optional[str] = None, verify: bool = False):
         self.IS_MACOS = platform.system() == "Darwin"
-        self.lldb = self._load_lldb_interface(lldb_path)
         self.logger = self._setup_logger()
+        # verify runs the binary once under lldb and keeps only the is_stmt lines that
+        # are hit; without it every is_stmt line is returned, executed or not
+        self.verify = verify
+        self.lldb = self._load_lldb_interface(lldb_path) if verify else None
 
     def _setup_logger(self):
         logger = logging.getLogger(__name__)
@@ -143,11 +238,7 @@ class LineNumberExtractor:
                 lldb = importlib.util.module_from_spec(spec)
                 spec.loader.exec_module(lldb)
             else:
-                lldb_executable = "lldb"
-                args = [lldb_executable, '-P']
-                pythonpath = subprocess.check_output(args, stderr=subprocess.STDOUT).rstrip().decode('utf-8')
-                sys.path.append(pythonpath)
-                lldb = importlib.import_module('lldb')
+                lldb = load_lldb_interface()
             return lldb
         except Exception as e:
             self.logger.error(f"Failed to load LLDB interface: {e}")
@@ -160,73 +251,83 @@ class LineNumberExtractor:
 
     def run_dwarfdump(self, binary_file: str, debug_info: bool = False) -> str:
         debug_file = self.get_debug_file_path(binary_file)
-        cmd = ["llvm-dwarfdump"]
+        cmd = [resolve_tool("llvm-dwarfdump")]
         if debug_info:
             cmd.append("--debug-info")
         else:
             cmd.append("--debug-line")
         cmd.append(debug_file)
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            result = subprocess.run(cmd, capture_output=True, close_fds=False, text=True, check=True)
             return result.stdout
         except subprocess.CalledProcessError as e:
             self.logger.error(f"Failed to run dwarfdump on {debug_file}: {e}")
             raise
 
+    def stream_debug_line(self, binary_file: str) -> Iterator[str]:
+        """Yield the `--debug-line` dump line by line while llvm-dwarfdump is still writing it."""
+        debug_file = self.get_debug_file_path(binary_file)
+        cmd = [resolve_tool("llvm-dwarfdump"), "--debug-line", debug_file]
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, close_fds=False,
+                              text=True) as proc:
+            yield from proc.stdout
+        if proc.returncode != 0:
+            e = subprocess.CalledProcessError(proc.returncode, cmd)
+            self.logger.error(f"Failed to run dwarfdump on {debug_file}: {e}")
+            raise e
+
     def get_source_files(self, binary_file: str) -> List[str]:
         output = self.run_dwarfdump(binary_file, debug_info=True)
         compile_unit_pattern = re.compile(r'DW_TAG_compile_unit.*?DW_AT_name\s+\("(.+?)"\)', re.DOTALL)
         return [os.path.basename(match.group(1)) for match in compile_unit_pattern.finditer(output)]
 
-    def parse_debug_line(self, output: str) -> Tuple[Dict[int, Dict[str, Any]], List[Dict[str, Any]]]:
+    def parse_debug_line(self, lines: Iterable[str]) -> Tuple[Dict[int, Dict[str, Any]], array, array, bytearray]:
+        # Rows are kept as parallel columns holding only what get_line_numbers_by_file
+        # reads, rather than one dict per row
         file_table = {}
-        line_info = []
+        file_nums = array('I')
+        line_nums = array('I')
+        is_stmt = bytearray()
         current_file = None
-        
-        file_table_pattern = re.compile(r'file_names\[\s*(\d+)\]:')
-        file_name_pattern = re.compile(r'name: "(.+)"')
-        dir_index_pattern = re.compile(r'dir_index: (\d+)')
-        line_entry_pattern = re.compile(r'0x([0-9a-f]+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(.*)')
-
         parsing_file_table = False
 
-        for line in output.split('\n'):
-            if line.startswith("file_names["):
+        for line in lines:
+            match = _DWARF_LINE_RE.search(line)
+            if match is None:
+                continue
+            kind = match.lastgroup
+            if kind == 'hdr':
                 parsing_file_table = True
-                if match := file_table_pattern.search(line):
-                    current_file = int(match.group(1))
-                    file_table[current_file] = {}
+                current_file = int(match['hdr_idx'])
+                file_table[current_file] = {}
+            elif kind == 'table':
+                # The row table header always ends the file table, even after an
+                # entry that had no dir_index
+                parsing_file_table = False
             elif parsing_file_table:
-                if match := file_name_pattern.search(line):
-                    file_table[current_file]['name'] = match.group(1)
-                elif match := dir_index_pattern.search(line):
-                    file_table[current_file]['dir_index'] = int(match.group(1))
+                if kind == 'name':
+                    file_table[current_file]['name'] = match['name_val']
+                elif kind == 'dir':
+                    file_table[current_file]['dir_index'] = int(match['dir_val'])
                     parsing_file_table = False
-            elif line.startswith("Address"):
-                parsing_file_table = False
-            elif match := line_entry_pattern.search(line):
-                address, line_num, column, file_num, isa, discriminator, flags = match.groups()
-                line_info.append({
-                    'address': int(address, 16),
-                    'line': int(line_num),
-                    'column': int(column),
-                    'file': int(file_num),
-                    'isa': int(isa),
-                    'discriminator': int(discriminator),
-                    'flags': flags.strip()
-                })
+            elif kind == 'row':
+                file_nums.append(int(match['fnum']))
+                line_nums.append(int(match['ln']))
+                is_stmt.append('is_stmt' in match['flags'])
    
-        return file_table, line_info
+        return file_table, file_nums, line_nums, is_stmt
 
-    def get_line_numbers_by_file(self, file_table: Dict[int, Dict[str, Any]], 
-                                 line_info: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+    def get_line_numbers_by_file(self, file_table: Dict[int, Dict[str, Any]], file_nums: array,
+                                 line_nums: array, is_stmt: bytearray) -> Dict[str, List[int]]:
         line_numbers_by_file = {}
-        for entry in line_info:
-            file_name = os.path.basename(file_table.get(entry['file'], {}).get('name', ''))
-            if file_name and 'is_stmt' in entry['flags']:
+        for file_num, line_num, stmt in zip(file_nums, line_nums, is_stmt):
+            if not stmt:
+                continue
+            file_name = os.path.basename(file_table.get(file_num, {}).get('name', ''))
+            if file_name:
                 if file_name not in line_numbers_by_file:
                     line_numbers_by_file[file_name] = set()
-                line_numbers_by_file[file_name].add(entry['line'])
+                line_numbers_by_file[file_name].add(line_num)
         
         return {file: sorted(lines) for file, lines in line_numbers_by_file.items()}
 
@@ -259,12 +360,14 @@ class LineNumberExtractor:
 
     def verify_line_nums(self, source_file: str, file_path: str, line_numbers: List[int]) -> Optional[List[int]]:
         with self._lldb_session(file_path) as target:
-            verified_line_nums = set()
             breakpoints = []
 
             for line_number in line_numbers:
                 bp = target.BreakpointCreateByLocation(source_file, line_number)
                 if bp.IsValid():
+                    # Hits are only counted, so the process runs to the end in one go
+                    # instead of stopping and being continued once per hit
+                    bp.SetAutoContinue(True)
                     breakpoints.append((bp, line_number))
                 else:
                     self.logger.warning(f"Could not create breakpoint at line {line_number}")
@@ -273,19 +376,17 @@ class LineNumberExtractor:
             if not process.IsValid():
                 self.logger.error("Could not launch process")
                 return None
-
-            while process.GetState() == self.lldb.eStateStopped:
-                thread = process.GetSelectedThread()
-                if thread.GetStopReason() == self.lldb.eStopReasonBreakpoint:
-                    frame = thread.GetFrameAtIndex(0)
-                    line_number_hit = frame.GetLineEntry().GetLine()
-                    for bp, line_number in breakpoints:
-                        if bp.GetHitCount() > 0 and line_number == line_number_hit:
-                            verified_line_nums.add(line_number)
-                            break
-                process.Continue()
-
-            return sorted(list(verified_line_nums))
+            # Stopped on something other than a breakpoint, e.g. a signal
+            if process.GetState() == self.lldb.eStateStopped:
+                process.Kill()
+
+            # A hit only verifies the line if the breakpoint actually resolved to it
+            return sorted({
+                line_number for bp, line_number in breakpoints
+                if bp.GetHitCount() > 0 and any(
+                    bp.GetLocationAtIndex(i).GetAddress().GetLineEntry().GetLine() == line_number
+                    for i in range(bp.GetNumLocations()))
+            })
     # _cleanup cannot work under ThreadPoolExcutor 
     # def verify_line_nums(self, source_file: str, file_path: str, line_numbers: List[int]) -> Optional[List[int]]:
     #     debugger = self.lldb.SBDebugger.Create()
@@ -346,13 +447,15 @@ class LineNumberExtractor:
     def get_line_nums(self, binary_file: str) -> Dict[str, List[int]]:
         try:
             source_files = self.get_source_files(binary_file)
-            dwarfdump_output = self.run_dwarfdump(binary_file)
-            file_table, line_info = self.parse_debug_line(dwarfdump_output)
-            line_numbers_by_file = self.get_line_numbers_by_file(file_table, line_info)
+            file_table, file_nums, line_nums, is_stmt = self.parse_debug_line(self.stream_debug_line(binary_file))
+            line_numbers_by_file = self.get_line_numbers_by_file(file_table, file_nums, line_nums, is_stmt)
             
             verified_line_numbers = {}
             for source_file, line_numbers in line_numbers_by_file.items():
                 if source_file in source_files:  # Only verify for compile units
+                    if not self.verify:
+                        verified_line_numbers[source_file] = line_numbers
+                        continue
                     verified_lines = self.verify_line_nums(source_file, binary_file, line_numbers)
                     if verified_lines:
                         verified_line_numbers[source_file] = verified_lines
@@ -362,23 +465,28 @@ class LineNumberExtractor:
             self.logger.error(f"Error in get_line_nums: {str(e)}")
             return {}
 
+def _work(binary_file: str, verify: bool) -> Tuple[str, Dict[str, List[int]]]:
+    # One binary per process: with verify, each gets its own lldb instead of sharing one
+    return binary_file, LineNumberExtractor(verify=verify).get_line_nums(binary_file)
+
 # Example usage
 if __name__ == "__main__":
-    extractor = LineNumberExtractor()
-    
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <binary_file1> [<binary_file2> ...]")
+    # Lines are verified under lldb as before unless --no-verify is given
+    verify = "--no-verify" not in sys.argv[1:]
+    binary_files = [arg for arg in sys.argv[1:] if arg != "--no-verify"]
+    if not binary_files:
+        print(f"Usage: {sys.argv[0]} [--no-verify] <binary_file1> [<binary_file2> ...]")
         sys.exit(1)
 
-    for binary_file in sys.argv[1:]:
-        line_nums_by_file = extractor.get_line_nums(binary_file)
-        if line_nums_by_file:
-            print(f"Results for {binary_file}:")
-            for source_file, line_nums in line_nums_by_file.items():
-                print(f"  Source file: {source_file}")
-                print(f"  Line numbers: {line_nums}")
-        else:
-            print(f"Failed to get line numbers for {binary_file}")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for binary_file, line_nums_by_file in ex.map(_work, binary_files, itertools.repeat(verify), chunksize=1):
+            if line_nums_by_file:
+                print(f"Results for {binary_file}:")
+                for source_file, line_nums in line_nums_by_file.items():
+                    print(f"  Source file: {source_file}")
+                    print(f"  Line numbers: {line_nums}")
+            else:
+                print(f"Failed to get line numbers for {binary_file}")
 
 # if __name__ == "__main__":
 #     logging.basicConfig(level=logging.DEBUG)